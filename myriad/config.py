@@ -68,6 +68,7 @@ class HParams:
   quadrature_rule: QuadratureRule = QuadratureRule.TRAPEZOIDAL
 
   max_iter: int = 1000  # maxiter for NLP solver (usually 1000)
+  float32_constraints_jac: bool = False  # evaluate the constraint Jacobian in single precision (not for EXTRAGRADIENT)
   intervals: int = 1  # used by COLLOCATION and SHOOTING
   controls_per_interval: int = 100  # used by SHOOTING
   fbsm_intervals: int = 1000  # used by FBSM
@@ -1,11 +1,12 @@
 # (c) 2021 Nikolaus Howe
 import jax
 import jax.numpy as jnp
+import numpy as np
 import time
 
-from cyipopt import minimize_ipopt
 from scipy.optimize import minimize
-from typing import Dict
+from scipy.sparse import coo_matrix
+from typing import Any, Callable, Dict, Tuple
 
 from myriad.config import Config, HParams, NLPSolverType
 from myriad.defaults import learning_rates
@@ -13,6 +14,79 @@ from myriad.utils import get_state_trajectory_and_cost
 
 ### Import your new nlp solver here ###
 from myriad.nlp_solvers.extra_gradient import extra_gradient
+from myriad.nlp_solvers.ipopt import ipopt
+
+
+def cache_last_call(fun: Callable[[np.ndarray], Any]) -> Callable[[np.ndarray], Any]:
+  """
+  Remember the most recent input and output of a function. SciPy's solvers evaluate the objective,
+  the constraints and their derivatives at the same point one after the other, so callbacks which
+  share a single underlying function can reuse its result instead of recomputing it.
+  Args:
+    fun: Function of the (NumPy) decision variables
+  Returns:
+    The same function, caching its last call
+  """
+  last_key, last_value = None, None
+
+  def cached_fun(x: np.ndarray) -> Any:
+    nonlocal last_key, last_value
+    key = np.asarray(x).tobytes()
+    if key != last_key:
+      last_key, last_value = key, fun(x)
+    return last_value
+
+  return cached_fun
+
+
+def value_and_jacrev(fun: Callable[[jnp.ndarray], jnp.ndarray]) -> Callable[[jnp.ndarray],
+                                                                           Tuple[jnp.ndarray, jnp.ndarray]]:
+  """
+  Like `jax.jacrev`, but also return the value of the function, reusing the forward pass
+  which reverse-mode differentiation has to do anyway.
+  Args:
+    fun: Vector-valued function
+  Returns:
+    A function which returns (fun(x), jacrev(fun)(x))
+  """
+  def value_and_jac(x: jnp.ndarray) -> Tuple[jnp.ndarray, jnp.ndarray]:
+    y, pullback = jax.vjp(fun, x)
+    jac, = jax.vmap(pullback)(jnp.eye(y.size, dtype=y.dtype))
+    return y, jac
+
+  return value_and_jac
+
+
+def value_and_jacfwd(fun: Callable[[jnp.ndarray], jnp.ndarray]) -> Callable[[jnp.ndarray],
+                                                                           Tuple[jnp.ndarray, jnp.ndarray]]:
+  """
+  Like `jax.jacfwd`, but also return the value of the function, reusing the linearization pass.
+  Args:
+    fun: Vector-valued function
+  Returns:
+    A function which returns (fun(x), jacfwd(fun)(x))
+  """
+  def value_and_jac(x: jnp.ndarray) -> Tuple[jnp.ndarray, jnp.ndarray]:
+    y, pushforward = jax.linearize(fun, x)
+    jac = jax.vmap(pushforward, out_axes=1)(jnp.eye(x.size, dtype=x.dtype))
+    return y, jac
+
+  return value_and_jac
+
+
+def in_float32(fun: Callable[[jnp.ndarray], jnp.ndarray]) -> Callable[[jnp.ndarray], jnp.ndarray]:
+  """
+  Evaluate a function of the decision variables in single precision, but hand back
+  the result in the precision of the input (so the solver itself is unaffected).
+  Args:
+    fun: Function of the decision variables
+  Returns:
+    The same function, computed in float32
+  """
+  def fun_32(x: jnp.ndarray) -> jnp.ndarray:
+    return fun(x.astype(jnp.float32)).astype(x.dtype)
+
+  return fun_32
 
 
 def solve(hp: HParams, cfg: Config, opt_dict: Dict) -> Dict[str, jnp.ndarray]:
@@ -28,16 +102,82 @@ def solve(hp: HParams, cfg: Config, opt_dict: Dict) -> Dict[str, jnp.ndarray]:
     (and for quadratic interpolation schemes, the midpoints too)
   """
   _t1 = time.time()
+  # JAX caches traces per function, so jit a fresh wrapper: the system's dynamics might
+  # have been swapped out since the last solve (as in `plan_with_node_model`)
+  maybe_jit = (lambda fun: jax.jit(lambda x: fun(x))) if cfg.jit else (lambda fun: fun)
+  objective_and_constraints = opt_dict.get('objective_and_constraints')
+  constraints_jac_values = opt_dict.get('constraints_jac_values')
+
+  if hp.nlpsolver == NLPSolverType.EXTRAGRADIENT:
+    # The extragradient solver traces through its callbacks, so it can't use the (Python-side) caches below
+    objective = maybe_jit(opt_dict['objective'])
+    objective_grad = maybe_jit(jax.grad(opt_dict['objective']))
+    constraints = maybe_jit(opt_dict['constraints'])
+    constraints_jac = maybe_jit(jax.jacrev(opt_dict['constraints']))
+  else:
+    # Forward mode takes a pass per decision variable, reverse mode a (more expensive) pass per constraint.
+    # Forward mode wins on the near-square Jacobians of multiple shooting with few controls per interval,
+    # reverse mode when there are many more decision variables than constraints (e.g. single shooting).
+    num_constraints = jax.eval_shape(opt_dict['constraints'], opt_dict['guess']).size
+    forward_mode = len(opt_dict['guess']) <= 2 * num_constraints
+
+    # Compile ahead of time for the shape of the guess, so that the solver's first iteration
+    # doesn't stall on compilation (and a call with a differently-shaped input fails loudly)
+    if cfg.jit:
+      maybe_jit = lambda fun: jax.jit(lambda x: fun(x)).lower(opt_dict['guess']).compile()
+
+    constraints_jac = None
+    if constraints_jac_values is not None:
+      # Only the nonzero entries are computed, and they're compiled here (not by the trajectory optimizer)
+      # so that they're retraced on every solve
+      if hp.float32_constraints_jac:
+        constraints_jac_values = in_float32(constraints_jac_values)
+      jac_values = maybe_jit(constraints_jac_values)
+      jac_rows, jac_cols, jac_shape = opt_dict['constraints_jac_structure']
+      constraints_jac = lambda x: coo_matrix((np.asarray(jac_values(x)), (jac_rows, jac_cols)), shape=jac_shape)
+    elif objective_and_constraints is not None or hp.float32_constraints_jac:
+      # A dense Jacobian on its own: the constraints either come from `objective_and_constraints`,
+      # or have to stay in double precision while the Jacobian doesn't
+      jacobian = (jax.jacfwd if forward_mode else jax.jacrev)(opt_dict['constraints'])
+      if hp.float32_constraints_jac:
+        jacobian = in_float32(jacobian)
+      constraints_jac = maybe_jit(jacobian)
+
+    # SciPy evaluates each function and its derivative at the same point in a row,
+    # so compute them together and let the second callback reuse the result of the first
+    if objective_and_constraints is not None:
+      # A single forward pass gives the objective, its gradient, and the constraints
+      value_and_grad = cache_last_call(maybe_jit(jax.value_and_grad(objective_and_constraints, has_aux=True)))
+      objective = lambda x: value_and_grad(x)[0][0]
+      objective_grad = lambda x: value_and_grad(x)[1]
+      constraints = lambda x: value_and_grad(x)[0][1]
+    else:
+      value_and_grad = cache_last_call(maybe_jit(jax.value_and_grad(opt_dict['objective'])))
+      objective = lambda x: value_and_grad(x)[0]
+      objective_grad = lambda x: value_and_grad(x)[1]
+      if constraints_jac is None:
+        value_and_jacobian = value_and_jacfwd if forward_mode else value_and_jacrev
+        value_and_jac = cache_last_call(maybe_jit(value_and_jacobian(opt_dict['constraints'])))
+        constraints = lambda x: value_and_jac(x)[0]
+        constraints_jac = lambda x: value_and_jac(x)[1]
+      else:
+        constraints = maybe_jit(opt_dict['constraints'])
+
+    if constraints_jac_values is not None and hp.nlpsolver not in (NLPSolverType.TRUST, NLPSolverType.IPOPT):
+      # Only trust-constr and IPOPT consume sparse Jacobians directly, the other solvers expect a dense array
+      sparse_constraints_jac = constraints_jac
+      constraints_jac = lambda x: sparse_constraints_jac(x).toarray()
+
   opt_inputs = {
-    'fun': jax.jit(opt_dict['objective']) if cfg.jit else opt_dict['objective'],
+    'fun': objective,
     'x0': opt_dict['guess'],
     'constraints': ({
       'type': 'eq',
-      'fun': jax.jit(opt_dict['constraints']) if cfg.jit else opt_dict['constraints'],
-      'jac': jax.jit(jax.jacrev(opt_dict['constraints'])) if cfg.jit else jax.jacrev(opt_dict['constraints']),
+      'fun': constraints,
+      'jac': constraints_jac,
     }),
     'bounds': opt_dict['bounds'],
-    'jac': jax.jit(jax.grad(opt_dict['objective'])) if cfg.jit else jax.grad(opt_dict['objective']),
+    'jac': objective_grad,
     'options': {"maxiter": hp.max_iter}
   }
 
@@ -55,7 +195,7 @@ def solve(hp: HParams, cfg: Config, opt_dict: Dict) -> Dict[str, jnp.ndarray]:
     solution = minimize(**opt_inputs)
   elif hp.nlpsolver == NLPSolverType.IPOPT:
     opt_inputs['method'] = 'ipopt'
-    solution = minimize_ipopt(**opt_inputs)
+    solution = ipopt(**opt_inputs)
   else:
     print("Unknown NLP solver. Please choose among", list(NLPSolverType.__members__.keys()))
     raise ValueError
@@ -87,8 +227,9 @@ def solve(hp: HParams, cfg: Config, opt_dict: Dict) -> Dict[str, jnp.ndarray]:
   # print("the full solution was", solution)
   # raise SystemExit
 
-  results = {'x': (opt_dict['unravel'](solution['x']))[0],
-             'u': (opt_dict['unravel'](solution['x']))[1],
+  opt_x, opt_u = opt_dict['unravel'](solution['x'])  # unravelled once; plot() moves what it needs to the host
+  results = {'x': opt_x,
+             'u': opt_u,
              'xs_and_us': solution['x'],
              'cost': solution['fun']}
 
@@ -1,7 +1,7 @@
 # (c) 2021 Nikolaus Howe
 import jax.numpy as jnp
 
-from jax import jit, grad
+from jax import jit, grad, lax
 
 from tensorboardX import SummaryWriter  # for parameter tuning
 writer = SummaryWriter()
@@ -17,6 +17,7 @@ def extra_gradient(fun, x0, method, constraints, bounds, jac, options):
   eta_x = options['eta_x'] if 'eta_x' in options else 1e-1  # primals
   eta_v = options['eta_v'] if 'eta_v' in options else 1e-3  # duals
   atol = options['atol'] if 'atol' in options else 1e-6  # convergence tolerance
+  eta_x, eta_v = 0.999 * eta_x, 0.999 * eta_v  # the step sizes are kept fixed at 0.999 times the given ones
 
   @jit
   def lagrangian(x, lmbda):
@@ -24,20 +25,27 @@ def extra_gradient(fun, x0, method, constraints, bounds, jac, options):
 
   @jit
   # We address bounds by clipping
-  def step(x, lmbda):
-    x_bar = jnp.clip(x - eta_x * grad(lagrangian, argnums=0)(x, lmbda),
-                     a_min=bounds[:, 0], a_max=bounds[:, 1])
-    x_new = jnp.clip(x - eta_x * grad(lagrangian, argnums=0)(x_bar, lmbda),
-                     a_min=bounds[:, 0], a_max=bounds[:, 1])
+  def step(x, lmbda, eta_x, eta_v):
+    x_bar = jnp.clip(x - eta_x * grad(lagrangian, argnums=0)(x, lmbda), bounds[:, 0], bounds[:, 1])
+    x_new = jnp.clip(x - eta_x * grad(lagrangian, argnums=0)(x_bar, lmbda), bounds[:, 0], bounds[:, 1])
     lmbda_new = lmbda + eta_v * grad(lagrangian, argnums=1)(x_new, lmbda)
     return x_new, lmbda_new
 
-  def solve(x, lmbda):
-    nonlocal eta_x, eta_v  # so we can modify them during solve
+  @jit
+  # Take a whole block of steps without coming back to Python in between
+  def steps(x, lmbda, eta_x, eta_v, num_steps):
+    def body(i, carry):
+      _, x, lmbda = carry
+      return (x, *step(x, lmbda, eta_x, eta_v))
+
+    return lax.fori_loop(0, num_steps, body, (x, x, lmbda))  # (previous x, x, lmbda)
 
+  def solve(x, lmbda):
     success = False
     x_old = x + 20  # just so we don't terminate immediately
-    for i in range(max_iter):
+    # Logging and the convergence check only happen every 1000 iterations,
+    # so the iterations in between run as a single compiled loop
+    for i in range(0, max_iter, 1000):
 
       if i % 2000 == 0:
         # Tensorboard recording here
@@ -49,19 +57,13 @@ def extra_gradient(fun, x0, method, constraints, bounds, jac, options):
           writer.add_scalar('constraints/hx_{}'.format(d), hi, i)
 
       # Success
-      if i % 1000 == 0 and jnp.allclose(x_old, x, rtol=0., atol=atol):  # tune tolerance according to need
+      if jnp.allclose(x_old, x, rtol=0., atol=atol):  # tune tolerance according to need
         success = True
         break
 
-      # Decrease step size
-      if i % 1000 == 0:
-        eta_x *= 0.999
-        eta_v *= 0.999
-
-      x_old = x
-      x, lmbda = step(x, lmbda)
+      x_old, x, lmbda = steps(x, lmbda, eta_x, eta_v, min(1000, max_iter - i))
 
-      if i % 1000 and (jnp.isnan(x).any() or jnp.isnan(lmbda).any()):
+      if jnp.isnan(x).any() or jnp.isnan(lmbda).any():
         print("WE GOT NANS")
         print("cur x", x)
         print("cur lmbda", lmbda)
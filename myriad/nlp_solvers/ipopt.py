@@ -0,0 +1,88 @@
+# (c) 2021 Nikolaus Howe
+import numpy as np
+
+from scipy.optimize import OptimizeResult
+from scipy.sparse import issparse
+
+try:
+  import cyipopt
+except ImportError:  # only needed for NLPSolverType.IPOPT
+  cyipopt = None
+
+
+class IpoptProblem(object):
+  """
+  The callbacks IPOPT needs, built out of the SciPy-style functions passed to `ipopt`.
+  The constraint Jacobian is handed over as the values of its nonzero entries only,
+  in the order given by `jacobianstructure`.
+  """
+  def __init__(self, fun, jac, constraint_fun, constraint_jac, jac_structure, jac_values):
+    self._fun = fun
+    self._jac = jac
+    self._constraint_fun = constraint_fun
+    self._constraint_jac = constraint_jac
+    self._jac_structure = jac_structure
+    self._jac_values = jac_values
+
+  def objective(self, x):
+    return float(self._fun(x))
+
+  def gradient(self, x):
+    return np.asarray(self._jac(x), dtype=float)
+
+  def constraints(self, x):
+    return np.asarray(self._constraint_fun(x), dtype=float)
+
+  def jacobian(self, x):
+    return np.asarray(self._jac_values(self._constraint_jac(x)), dtype=float)
+
+  def jacobianstructure(self):
+    return self._jac_structure
+
+
+def ipopt(fun, x0, method, constraints, bounds, jac, options):
+  """
+  Solve the NLP with IPOPT, taking the same arguments as `scipy.optimize.minimize`.
+    If the constraint Jacobian is a `scipy.sparse` matrix, IPOPT only ever sees its nonzero entries.
+    The sparsity structure is read off the Jacobian at x0, so it must not change from one call to the next.
+  """
+  del method
+  if cyipopt is None:
+    raise ImportError("Solving with IPOPT requires cyipopt (see requirements.txt)")
+
+  x0 = np.asarray(x0, dtype=float)
+  bounds = np.asarray(bounds)
+  constraint_fun = constraints['fun']
+  constraint_jac = constraints['jac']
+  num_constraints = np.size(constraint_fun(x0))
+
+  jac_0 = constraint_jac(x0)
+  if issparse(jac_0):
+    jac_0 = jac_0.tocoo()
+    jac_structure = (jac_0.row, jac_0.col)
+    jac_values = lambda j: j.tocoo().data
+  else:  # dense, so every entry is part of the structure
+    rows, cols = np.indices(np.shape(jac_0))
+    jac_structure = (rows.ravel(), cols.ravel())
+    jac_values = np.ravel
+
+  problem = cyipopt.Problem(
+    n=len(x0),
+    m=num_constraints,
+    problem_obj=IpoptProblem(fun, jac, constraint_fun, constraint_jac, jac_structure, jac_values),
+    lb=bounds[:, 0],
+    ub=bounds[:, 1],
+    cl=np.zeros(num_constraints),
+    cu=np.zeros(num_constraints),
+  )
+  problem.add_option('max_iter', int(options['maxiter']))
+  problem.add_option('hessian_approximation', 'limited-memory')  # we don't provide the Hessian
+
+  x, info = problem.solve(x0)
+
+  return OptimizeResult(x=x,
+                        fun=info['obj_val'],
+                        success=info['status'] == 0,
+                        status=info['status'],
+                        message=info['status_msg'],
+                        info=info)
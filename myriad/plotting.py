@@ -1,4 +1,5 @@
 # (c) 2021 Nikolaus Howe
+import jax
 import jax.numpy as jnp
 import matplotlib
 import matplotlib.pyplot as plt
@@ -93,6 +94,9 @@ def plot(hp, system,
       'pgf.rcfonts': False,
     })
 
+  # Bring everything over to the host in one go, rather than once per matplotlib call
+  data = jax.tree_util.tree_map(np.asarray, data)
+
   if styles is None:
     styles = {}
     for name in data:
@@ -139,8 +143,8 @@ def plot(hp, system,
 
   order_multiplier = 2 if hp.integration_method == IntegrationMethod.RK4 else 1
 
-  ts_x = jnp.linspace(0, system.T, data['x'].shape[0])
-  ts_u = jnp.linspace(0, system.T, data['u'].shape[0])
+  ts_x = np.linspace(0, system.T, data['x'].shape[0])
+  ts_u = np.linspace(0, system.T, data['u'].shape[0])
 
   # Every system except SIMPLECASE and SIMPLECASEWITHBOUNDS
   # Plot exactly those state columns which we want plotted
@@ -151,13 +155,13 @@ def plot(hp, system,
         plt.plot(ts_x, x_i, styles['x'], lw=widths['x'],
                  label=state_descriptions[hp.system][1][idx] + labels['x'])
         if 'other_x' in data:
-          plt.plot(jnp.linspace(0, system.T, data['other_x'][:, idx].shape[0]),
+          plt.plot(np.linspace(0, system.T, data['other_x'][:, idx].shape[0]),
                    data['other_x'][:, idx], styles['other_x'], lw=widths['other_x'],
                    label=state_descriptions[hp.system][1][idx] + labels['other_x'])
   else:
     plt.plot(ts_x, data['x'], styles['x'], lw=widths['x'], label=labels['x'])
     if 'other_x' in data:
-      plt.plot(jnp.linspace(0, system.T, data['other_x'].shape[0]),
+      plt.plot(np.linspace(0, system.T, data['other_x'].shape[0]),
                data['other_x'], styles['other_x'], lw=widths['other_x'], label=labels['other_x'])
   plt.ylabel("state (x)")
   plt.grid()
@@ -170,13 +174,13 @@ def plot(hp, system,
       if idx in control_descriptions[hp.system][0]:
         plt.plot(ts_u, u_i, styles['u'], lw=widths['u'], label=control_descriptions[hp.system][1][idx] + labels['u'])
         if 'other_u' in data and data['other_u'] is not None:
-          plt.plot(jnp.linspace(0, system.T, data['other_u'][:, idx].shape[0]),
+          plt.plot(np.linspace(0, system.T, data['other_u'][:, idx].shape[0]),
                    data['other_u'][:, idx], styles['other_u'], lw=widths['other_u'],
                    label=control_descriptions[hp.system][1][idx] + labels['other_u'])
   else:
     plt.plot(ts_u, data['u'], styles['u'], lw=widths['u'], label=labels['u'])
     if 'other_u' in data:
-      plt.plot(jnp.linspace(0, system.T, data['other_u'].shape[0]),
+      plt.plot(np.linspace(0, system.T, data['other_u'].shape[0]),
                data['other_u'], styles['other_u'], lw=widths['other_u'], label=labels['other_u'])
   plt.ylabel("control (u)")
   plt.grid()
@@ -231,7 +235,7 @@ def plot(hp, system,
     ax.add_artist(at, )
 
   if 'adj' in data:
-    ts_adj = jnp.linspace(0, system.T, data['adj'].shape[0])
+    ts_adj = np.linspace(0, system.T, data['adj'].shape[0])
     plt.subplot(num_subplots, 1, 3)
     if labels is not None and 'adj' in labels:
       plt.plot(ts_adj, data['adj'], label=labels['adj'])
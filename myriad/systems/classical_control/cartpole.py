@@ -74,17 +74,8 @@ class CartPole(FiniteHorizonControlSystem):
 
   # Cart-Pole Example: System Dynamics (Section 6.1)
   def dynamics(self, x_t: State, u_t: Control, t: Optional[Timestep] = None) -> DState:
-    x, theta, dx, dtheta = x_t
-    # Eq. 6.1
-    ddx = ((self.length * self.m2 * jnp.sin(theta) * dtheta ** 2 + u_t + self.m2 * self.g * jnp.cos(theta) * jnp.sin(theta))
-           / (self.m1 + self.m2 * (1 - jnp.cos(theta) ** 2)))
-    ddx = jnp.squeeze(ddx)
-    # Eq. 6.2
-    ddtheta = - ((self.length * self.m2 * jnp.cos(theta) * dtheta ** 2 + u_t * jnp.cos(theta)
-                  + (self.m1 + self.m2) * self.g * jnp.sin(theta))
-                 / (self.length * self.m1 + self.length * self.m2 * (1 - jnp.cos(theta) ** 2)))
-    ddtheta = jnp.squeeze(ddtheta)
-    return jnp.array([dx, dtheta, ddx, ddtheta])
+    params = {'g': self.g, 'm1': self.m1, 'm2': self.m2, 'length': self.length}
+    return self.parametrized_dynamics(params, x_t, u_t, t)
 
   def parametrized_dynamics(self, params: Params, x_t: State, u_t: Control, t: Optional[Timestep] = None) -> DState:
     g = jnp.abs(params['g'])  # convert negative values to positive ones
@@ -101,7 +92,7 @@ class CartPole(FiniteHorizonControlSystem):
                   + (m1 + m2) * g * jnp.sin(theta))
                  / (length * m1 + length * m2 * (1 - jnp.cos(theta) ** 2)))
     ddtheta = jnp.squeeze(ddtheta)
-    return jnp.array([dx, dtheta, ddx, ddtheta])
+    return jnp.stack([dx, dtheta, ddx, ddtheta])
 
   def cost(self, x_t: State, u_t: Control, t: Timestep = None) -> Cost:
     # Eq. 6.3
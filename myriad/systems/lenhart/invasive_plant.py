@@ -1,6 +1,7 @@
 import gin
 import jax.numpy as jnp
 import matplotlib.pyplot as plt
+import numpy as np
 
 from typing import Union, Optional
 
@@ -96,9 +97,9 @@ class InvasivePlant(IndirectFHCS):
 
     x, u, adj = x.T, u.T, adj.T
 
-    ts_x = jnp.linspace(0, self.T, x[0].shape[0])
-    ts_u = jnp.linspace(0, self.T - 1, u[0].shape[0])
-    ts_adj = jnp.linspace(0, self.T, adj[0].shape[0])
+    ts_x = np.linspace(0, self.T, x[0].shape[0])
+    ts_u = np.linspace(0, self.T - 1, u[0].shape[0])
+    ts_adj = np.linspace(0, self.T, adj[0].shape[0])
 
     labels = ["Focus 1", "Focus 2", "Focus 3", "Focus 4", "Focus 5"]
 
@@ -82,15 +82,14 @@ class SEIR(FiniteHorizonControlSystem):
 
   def dynamics(self, y_t: jnp.ndarray, u_t: float, t: float = None) -> jnp.ndarray:
     S, E, I, N = y_t
+    u_t = jnp.reshape(u_t, ())  # the control is a scalar, whether it comes in with shape () or (1,)
 
-    s_dot = jnp.squeeze(self.b*N - self.d*S - self.c*S*I - u_t*S)
-    e_dot = jnp.squeeze(self.c*S*I - (self.e+self.d)*E)
-    i_dot = jnp.squeeze(self.e*E - (self.g+self.a+self.d)*I)
-    n_dot = jnp.squeeze((self.b-self.d)*N - self.a*I)
+    infection = self.c*S*I
+    return jnp.stack([self.b*N - self.d*S - infection - u_t*S,
+                      infection - (self.e+self.d)*E,
+                      self.e*E - (self.g+self.a+self.d)*I,
+                      (self.b-self.d)*N - self.a*I])
 
-    y_t_dot = jnp.array([s_dot, e_dot, i_dot, n_dot])
-    return y_t_dot
-  
   def cost(self, y_t: jnp.ndarray, u_t: float, t: float = None) -> float:
     return self.A * y_t[2] + u_t ** 2
 
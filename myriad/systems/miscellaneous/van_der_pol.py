@@ -44,17 +44,14 @@ class VanDerPol(FiniteHorizonControlSystem):
     )
 
   def dynamics(self, x_t: jnp.ndarray, u_t: float, t: float = None) -> jnp.ndarray:
-    x0, x1 = x_t
-    _x0 = jnp.squeeze(self.a * (1. - x1 ** 2) * x0 - x1 + u_t)
-    _x1 = jnp.squeeze(x0)
-    return jnp.asarray([_x0, _x1])
+    return self.parametrized_dynamics({'a': self.a}, x_t, u_t, t)
 
   def parametrized_dynamics(self, params: Params, x_t: jnp.ndarray, u_t: float, t: float = None) -> jnp.ndarray:
     a = params['a']
     x0, x1 = x_t
     _x0 = jnp.squeeze(a * (1. - x1 ** 2) * x0 - x1 + u_t)
     _x1 = jnp.squeeze(x0)
-    return jnp.asarray([_x0, _x1])
+    return jnp.stack([_x0, _x1])
 
   def cost(self, x_t: jnp.ndarray, u_t: float, t: float = None) -> float:
     return x_t.T @ x_t + u_t ** 2
@@ -50,6 +50,12 @@ class TrajectoryOptimizer(object):
   """Use to separate decision variable array into states and controls"""
   require_adj: bool = False
   """Does this trajectory optimizer require adjoint dynamics in order to work?"""
+  constraints_jac_values: Optional[Callable[[jnp.ndarray], jnp.ndarray]] = None
+  """(Optional) Nonzero entries of the constraint Jacobian; if absent, the NLP solver falls back to a dense Jacobian"""
+  constraints_jac_structure: Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]] = None
+  """(Optional) Rows, columns and shape of the sparse constraint Jacobian, matching `constraints_jac_values`"""
+  objective_and_constraints: Optional[Callable[[jnp.ndarray], Tuple[float, jnp.ndarray]]] = None
+  """(Optional) Objective and constraints computed together, so the NLP solver can share work between them"""
 
   def __post_init__(self):
     if self.cfg.verbose:
@@ -72,7 +78,10 @@ class TrajectoryOptimizer(object):
       'guess': self.guess,
       'constraints': self.constraints,
       'bounds': self.bounds,
-      'unravel': self.unravel
+      'unravel': self.unravel,
+      'constraints_jac_values': self.constraints_jac_values,
+      'constraints_jac_structure': self.constraints_jac_structure,
+      'objective_and_constraints': self.objective_and_constraints
     }
 
     return solve(self.hp, self.cfg, opt_inputs)
@@ -1,15 +1,16 @@
 # (c) 2021 Nikolaus Howe
+import jax
 import jax.numpy as jnp
 import numpy as np
 
 from jax import vmap
-from jax.flatten_util import ravel_pytree
 from typing import Tuple
 
 from myriad.config import Config, HParams
 from myriad.custom_types import Control, Controls, Cost, DState, DStates, Params, State, States, Timestep
 from myriad.systems import FiniteHorizonControlSystem
 from myriad.trajectory_optimizers.base import TrajectoryOptimizer
+from myriad.utils import ravel_states_and_controls
 
 
 class HermiteSimpsonCollocationOptimizer(TrajectoryOptimizer):
@@ -44,7 +45,7 @@ class HermiteSimpsonCollocationOptimizer(TrajectoryOptimizer):
 
     initial_variables = (x_guess, u_guess)
 
-    guess, unravel_decision_variables = ravel_pytree(initial_variables)
+    guess, unravel_decision_variables = ravel_states_and_controls(*initial_variables)
     self.x_guess, self.u_guess = x_guess, u_guess
 
     ############################
@@ -56,7 +57,7 @@ class HermiteSimpsonCollocationOptimizer(TrajectoryOptimizer):
     x_bounds[:, :, :] = system.bounds[:-control_shape]
 
     # Starting state
-    x_bounds[0, :, :] = jnp.expand_dims(system.x_0, 1)
+    x_bounds[0, :, :] = np.expand_dims(system.x_0, 1)
 
     # Ending state
     if system.x_T is not None:
@@ -67,17 +68,14 @@ class HermiteSimpsonCollocationOptimizer(TrajectoryOptimizer):
     # Reshape for call to 'minimize'
     x_bounds = x_bounds.reshape((-1, 2))
 
-    # Bounds for controls
-    u_bounds = np.empty(((2 * hp.intervals + 1) * control_shape, 2))  # Include midpoints too
-    for i in range(control_shape, 0, -1):
-      u_bounds[(control_shape - i) * (2 * hp.intervals + 1):(control_shape - i + 1) * (
-              2 * hp.intervals + 1)] = system.bounds[-i]
+    # Bounds for controls (include midpoints too)
+    u_bounds = np.broadcast_to(system.bounds[-control_shape:], (2 * hp.intervals + 1, control_shape, 2))
 
     # Reshape for call to 'minimize'
     u_bounds = u_bounds.reshape((-1, 2))
 
     # Stack all bounds together for the NLP solver
-    bounds = jnp.vstack((x_bounds, u_bounds))
+    bounds = np.vstack((x_bounds, u_bounds))
     self.x_bounds, self.u_bounds = x_bounds, u_bounds
 
     # Helper function
@@ -347,5 +345,163 @@ class HermiteSimpsonCollocationOptimizer(TrajectoryOptimizer):
       interpolation_defects = parametrized_hs_interpolation_constraints(params, variables)
       return jnp.hstack((equality_defects, interpolation_defects))
 
+    def objective_and_constraints(variables: jnp.ndarray) -> Tuple[Cost, DStates]:
+      """
+      Calculate the objective and all constraint violations for this trajectory together.
+        The dynamics and cost are evaluated once per knot point and midpoint, and shared between
+        the defect and interpolation constraints (and the neighbouring intervals) which use them.
+      Args:
+        variables: Raveled states and controls
+      Returns:
+        (Objective of trajectory, all constraint violations of trajectory)
+      """
+      xs, us = unravel_decision_variables(variables)
+      all_times = jnp.linspace(0, system.T, num=2 * hp.intervals + 1)  # Support cost function with dependency on t
+      fs = vmap(system.dynamics)(xs, us)
+      cs = vmap(system.cost)(xs, us, all_times)
+
+      start_xs, mid_xs, next_xs = xs[:-1:2], xs[1::2], xs[2::2]
+      start_fs, mid_fs, next_fs = fs[:-1:2], fs[1::2], fs[2::2]
+      cost = jnp.sum((interval_duration / 6) * (cs[:-1:2] + 4 * cs[1::2] + cs[2::2]))
+      equality_defects = (next_xs - start_xs) - (interval_duration / 6) * (start_fs + 4 * mid_fs + next_fs)
+      interpolation_defects = (mid_xs - (1 / 2) * (start_xs + next_xs)
+                               - (interval_duration / 8) * (start_fs - next_fs))
+      return cost, jnp.hstack((jnp.ravel(equality_defects), jnp.ravel(interpolation_defects)))
+
+    #################
+    # Interpolation #
+    #################
+    def hs_control_interpolation(t: Timestep, us: Controls) -> Control:
+      """
+      Quadratic interpolation of the controls, see (4.10) of the reference
+      Args:
+        t: Time at which to interpolate
+        us: Controls, including midpoints
+      Returns:
+        Interpolated control at time t
+      """
+      k = jnp.clip(jnp.floor(t / interval_duration).astype(jnp.int32), 0, hp.intervals - 1)
+      tau = t - k * interval_duration
+      return ((2 / interval_duration ** 2) * (tau - interval_duration / 2) * (tau - interval_duration) * us[2 * k]
+              - (4 / interval_duration ** 2) * tau * (tau - interval_duration) * us[2 * k + 1]
+              + (2 / interval_duration ** 2) * tau * (tau - interval_duration / 2) * us[2 * k + 2])
+
+    def hs_state_interpolation(t: Timestep, xs: States, fs: DStates) -> State:
+      """
+      Cubic interpolation of the states, see (4.9) of the reference
+      Args:
+        t: Time at which to interpolate
+        xs: States, including midpoints
+        fs: Dynamics evaluated at each of those states (and corresponding controls)
+      Returns:
+        Interpolated state at time t
+      """
+      k = jnp.clip(jnp.floor(t / interval_duration).astype(jnp.int32), 0, hp.intervals - 1)
+      tau = t - k * interval_duration
+      f_k, f_mid, f_next = fs[2 * k], fs[2 * k + 1], fs[2 * k + 2]
+      return (xs[2 * k]
+              + f_k * tau
+              + (1 / (2 * interval_duration)) * (-3 * f_k + 4 * f_mid - f_next) * tau ** 2
+              + (1 / (3 * interval_duration ** 2)) * (2 * f_k - 4 * f_mid + 2 * f_next) * tau ** 3)
+
+    def interpolate_states(ts: jnp.ndarray, xs: States, us: Controls) -> States:
+      """
+      Cubic interpolation of the states at many times
+      Args:
+        ts: Times at which to interpolate
+        xs: States, including midpoints
+        us: Controls, including midpoints
+      Returns:
+        Interpolated states at times ts
+      """
+      xs, us = jnp.asarray(xs), jnp.asarray(us)  # also accept the solver's (host) results
+      fs = vmap(system.dynamics)(xs, us)  # only evaluate the dynamics once per knot point and midpoint
+      return vmap(hs_state_interpolation, in_axes=(0, None, None))(ts, xs, fs)
+
+    def interpolate_controls(ts: jnp.ndarray, us: Controls) -> Controls:
+      """
+      Quadratic interpolation of the controls at many times
+      Args:
+        ts: Times at which to interpolate
+        us: Controls, including midpoints
+      Returns:
+        Interpolated controls at times ts
+      """
+      return vmap(hs_control_interpolation, in_axes=(0, None))(ts, jnp.asarray(us))
+
+    # Evaluate the interpolants at a whole array of times at once (for example, for plotting).
+    # Not jitted here: a trace would keep using the dynamics from before plan_with_node_model swaps them
+    self.interpolate_controls = interpolate_controls
+    self.interpolate_states = interpolate_states
+
+    #######################
+    # Constraint Jacobian #
+    #######################
+
+    # Each interval's defect and interpolation constraints only depend on the six
+    # (state, mid state, next state, control, mid control, next control) blocks of that interval,
+    # so the constraint Jacobian is block-sparse with a structure which doesn't depend on the variables.
+    num_state_vars = (2 * hp.intervals + 1) * state_shape
+    interval_starts = 2 * np.arange(hp.intervals)  # index of the knot point at the start of each interval
+
+    def block_indices(first_row: int, block_starts: np.ndarray, block_width: int) -> Tuple[np.ndarray, np.ndarray]:
+      """
+      Calculate the (row, column) position of every entry of a batch of per-interval Jacobian blocks
+      Args:
+        first_row: Row of the Jacobian at which this batch of constraints starts
+        block_starts: Column of the Jacobian at which each interval's block starts
+        block_width: Number of columns in each block
+      Returns:
+        (rows, cols), in the same (interval, row, column) order as the raveled blocks
+      """
+      shape = (hp.intervals, state_shape, block_width)
+      rows = first_row + state_shape * np.arange(hp.intervals)[:, None, None] + np.arange(state_shape)[None, :, None]
+      cols = block_starts[:, None, None] + np.arange(block_width)[None, None, :]
+      return np.broadcast_to(rows, shape).ravel(), np.broadcast_to(cols, shape).ravel()
+
+    jac_rows, jac_cols = [], []
+    for first_row, control_offsets in ((0, range(3)),  # defect constraints
+                                       (hp.intervals * state_shape, (0, 2))):  # interpolation constraints
+      for offset in range(3):  # states
+        rows, cols = block_indices(first_row, (interval_starts + offset) * state_shape, state_shape)
+        jac_rows.append(rows)
+        jac_cols.append(cols)
+      for offset in control_offsets:  # controls (the interpolation doesn't depend on the mid control)
+        rows, cols = block_indices(first_row, num_state_vars + (interval_starts + offset) * control_shape,
+                                   control_shape)
+        jac_rows.append(rows)
+        jac_cols.append(cols)
+    jac_rows, jac_cols = np.concatenate(jac_rows), np.concatenate(jac_cols)
+    jac_structure = (jac_rows, jac_cols, (2 * hp.intervals * state_shape, len(guess)))
+
+    def constraint_jacobian_blocks(variables: jnp.ndarray) -> jnp.ndarray:
+      """
+      Calculate the nonzero blocks of the constraint Jacobian, one interval at a time.
+        The defect and interpolation constraints are linear in the dynamics evaluated at the knot points
+        and midpoints, so their blocks are assembled in closed form out of the Jacobians of the dynamics,
+        each of which is only evaluated once (knot points are shared between neighbouring intervals).
+      Args:
+        variables: Raveled states and controls
+      Returns:
+        The raveled blocks, ordered to match (jac_rows, jac_cols)
+      """
+      xs, us = unravel_decision_variables(variables)
+      dfdx, dfdu = vmap(jax.jacfwd(system.dynamics, argnums=(0, 1)))(xs, us)
+      dfdx = dfdx.reshape(-1, state_shape, state_shape)  # in case of scalar states or controls
+      dfdu = dfdu.reshape(-1, state_shape, control_shape)
+      start_dfdx, mid_dfdx, next_dfdx = dfdx[:-1:2], dfdx[1::2], dfdx[2::2]
+      start_dfdu, mid_dfdu, next_dfdu = dfdu[:-1:2], dfdu[1::2], dfdu[2::2]
+      eye = jnp.eye(state_shape, dtype=dfdx.dtype)
+
+      h = interval_duration
+      defect_blocks = (-eye - h / 6 * start_dfdx, -4 * h / 6 * mid_dfdx, eye - h / 6 * next_dfdx,
+                       -h / 6 * start_dfdu, -4 * h / 6 * mid_dfdu, -h / 6 * next_dfdu)
+      interpolation_blocks = (-eye / 2 - h / 8 * start_dfdx, jnp.broadcast_to(eye, mid_dfdx.shape),
+                              -eye / 2 + h / 8 * next_dfdx,
+                              -h / 8 * start_dfdu, h / 8 * next_dfdu)
+      return jnp.concatenate([jnp.ravel(block) for block in defect_blocks + interpolation_blocks])
+
     super().__init__(hp, cfg, objective, parametrized_objective, constraints, parametrized_constraints,
-                     bounds, guess, unravel_decision_variables)
+                     bounds, guess, unravel_decision_variables, constraints_jac_values=constraint_jacobian_blocks,
+                     constraints_jac_structure=jac_structure,
+                     objective_and_constraints=objective_and_constraints)
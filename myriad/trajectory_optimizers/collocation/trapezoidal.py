@@ -3,13 +3,12 @@ import jax.numpy as jnp
 import numpy as np
 
 from jax import vmap
-from jax.flatten_util import ravel_pytree
 
 from myriad.config import Config, HParams
 from myriad.custom_types import Control, Cost, DState, Params, State, Timestep, DStates
 from myriad.trajectory_optimizers.base import TrajectoryOptimizer
 from myriad.systems import FiniteHorizonControlSystem
-from myriad.utils import integrate_time_independent
+from myriad.utils import integrate_time_independent, ravel_states_and_controls
 
 
 class TrapezoidalCollocationOptimizer(TrajectoryOptimizer):
@@ -48,17 +47,14 @@ class TrapezoidalCollocationOptimizer(TrajectoryOptimizer):
     else:  # no final state requirement
       _, x_guess = integrate_time_independent(system.dynamics, system.x_0,
                                               u_guess, h, num_intervals, hp.integration_method)
-    guess, unravel_decision_variables = ravel_pytree((x_guess, u_guess))
+    guess, unravel_decision_variables = ravel_states_and_controls(x_guess, u_guess)
     self.x_guess, self.u_guess = x_guess, u_guess
 
     ############################
     # State and Control Bounds #
     ############################
     # Control bounds
-    u_bounds = np.empty(((num_intervals + 1) * control_shape, 2))
-    for i in range(control_shape, 0, -1):
-      u_bounds[(control_shape - i) * (num_intervals + 1)
-               :(control_shape - i + 1) * (num_intervals + 1)] = system.bounds[-i]
+    u_bounds = np.broadcast_to(system.bounds[-control_shape:], (num_intervals + 1, control_shape, 2))
 
     # Reshape to work with NLP solver
     u_bounds = u_bounds.reshape((-1, 2))
@@ -74,7 +70,7 @@ class TrapezoidalCollocationOptimizer(TrajectoryOptimizer):
     x_bounds = x_bounds.reshape((-1, 2))
 
     # Put control and state bounds together
-    bounds = jnp.vstack((x_bounds, u_bounds))
+    bounds = np.vstack((x_bounds, u_bounds))
     self.x_bounds, self.u_bounds = x_bounds, u_bounds
 
     def trapezoid_cost(x_t1: State, x_t2: State,
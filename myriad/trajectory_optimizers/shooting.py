@@ -3,12 +3,13 @@ import jax
 import jax.numpy as jnp
 import numpy as np
 
-from jax.flatten_util import ravel_pytree
+from typing import Tuple
 
 from myriad.config import Config, HParams, IntegrationMethod
 from myriad.custom_types import Control, Params, Timestep
 from myriad.systems import FiniteHorizonControlSystem
-from myriad.utils import integrate_in_parallel, integrate_time_independent, integrate_time_independent_in_parallel
+from myriad.utils import integrate_in_parallel, integrate_time_independent, integrate_time_independent_in_parallel, \
+  ravel_states_and_controls
 from myriad.trajectory_optimizers.base import TrajectoryOptimizer
 
 
@@ -72,7 +73,7 @@ class MultipleShootingOptimizer(TrajectoryOptimizer):
       _, x_guess = integrate_time_independent(system.dynamics, system.x_0,
                                               controls_guess[::midpoints_const * hp.controls_per_interval],
                                               interval_size, hp.intervals, hp.integration_method)
-    guess, unravel = ravel_pytree((x_guess, controls_guess))
+    guess, unravel = ravel_states_and_controls(x_guess, controls_guess)
     assert len(x_guess) == hp.intervals + 1  # we have one state decision var for each node, including start and end
     self.x_guess, self.u_guess = x_guess, controls_guess
 
@@ -189,6 +190,17 @@ class MultipleShootingOptimizer(TrajectoryOptimizer):
       # else:
       #   return h_u * jnp.sum(vmap(system.cost)(x, u, t))
       # ---
+      return objective_and_constraints(variables)[0]
+
+    def objective_and_constraints(variables: jnp.ndarray) -> Tuple[float, jnp.ndarray]:
+      """
+      Calculate the objective and the constraint violations of a trajectory,
+      sharing a single integration between the two
+      Args:
+        variables: Raveled states and controls
+      Returns:
+        The objective of the trajectory, and its constraint violations
+      """
       xs, us = unravel(variables)
       reshaped_controls = reorganize_controls(us)
 
@@ -207,7 +219,8 @@ class MultipleShootingOptimizer(TrajectoryOptimizer):
         last_augmented_state = states_and_costs[-1]
         costs += system.terminal_cost_fn(last_augmented_state[:-1], us[-1])
 
-      return costs
+      # The cost doesn't feed back into the dynamics, so the end states are the same as in 'constraints'
+      return costs, jnp.ravel(states_and_costs[:, :-1] - xs[1:])
 
     def parametrized_constraints(params: Params, variables: jnp.ndarray) -> jnp.ndarray:
       """
@@ -249,7 +262,7 @@ class MultipleShootingOptimizer(TrajectoryOptimizer):
     x_bounds[:, :, :] = system.bounds[:-control_shape]
 
     # Starting state
-    x_bounds[0, :, :] = jnp.expand_dims(system.x_0, 1)
+    x_bounds[0, :, :] = np.expand_dims(system.x_0, 1)
 
     # Ending state
     if system.x_T is not None:
@@ -261,18 +274,15 @@ class MultipleShootingOptimizer(TrajectoryOptimizer):
     x_bounds = x_bounds.reshape((-1, 2))
 
     # Control decision variables at every node, and if RK4, also at midpoints
-    u_bounds = np.empty(((midpoints_const * num_steps + 1) * control_shape, 2))  # Include midpoints too
-    for i in range(control_shape, 0, -1):
-      u_bounds[(control_shape - i) * (midpoints_const * num_steps + 1):(control_shape - i + 1) * (
-              midpoints_const * num_steps + 1)] = system.bounds[-i]
+    u_bounds = np.broadcast_to(system.bounds[-control_shape:], (midpoints_const * num_steps + 1, control_shape, 2))
 
     # Reshape for call to 'minimize'
     u_bounds = u_bounds.reshape((-1, 2))
 
     # print("u bounds", u_bounds)
     # Stack all bounds together for the NLP solver
-    bounds = jnp.vstack((x_bounds, u_bounds))
+    bounds = np.vstack((x_bounds, u_bounds))
     self.x_bounds, self.u_bounds = x_bounds, u_bounds
 
     super().__init__(hp, cfg, objective, parametrized_objective, constraints, parametrized_constraints,
-                     bounds, guess, unravel)
+                     bounds, guess, unravel, objective_and_constraints=objective_and_constraints)
@@ -15,6 +15,7 @@ from myriad.config import HParams, Config
 from myriad.custom_types import Cost, Defect, Optional
 from myriad.neural_ode.create_node import NeuralODE
 from myriad.trajectory_optimizers import get_optimizer
+from myriad.trajectory_optimizers.collocation.hermite_simpson import HermiteSimpsonCollocationOptimizer
 from myriad.utils import get_defect, integrate_time_independent, get_state_trajectory_and_cost, plan_with_node_model
 from myriad.plotting import plot
 from myriad.systems.neural_ode.node_system import NodeSystem
@@ -66,6 +67,10 @@ def run_trajectory_opt(hp: HParams, cfg: Config, save_as: str = None,
                      'other_x': ' (integrated)'},
              save_as=save_as)
       else:
+        if isinstance(optimizer, HermiteSimpsonCollocationOptimizer):
+          # Show the solver's piecewise-polynomial solution in between the knot points and midpoints too
+          ts = np.linspace(0, system.T, 10 * (x.shape[0] - 1) + 1)
+          x, u = optimizer.interpolate_states(ts, x, u), optimizer.interpolate_controls(ts, u)
         plot(hp, true_system,
              data={'x': x, 'u': u, 'other_x': opt_x, 'cost': c, 'defect': defect},
              labels={'x': ' (from solver)',
@@ -11,6 +11,7 @@ if typing.TYPE_CHECKING:
   from myriad.neural_ode.create_node import NeuralODE
   from myriad.config import HParams, Config
 
+from functools import partial
 from jax import jit, lax, vmap
 from typing import Callable, Optional, Tuple, Dict
 
@@ -29,6 +30,9 @@ def integrate(
         integration_method: IntegrationMethod  # allows user to choose interpolation for controls
 ) -> Tuple[State, States]:
   # QUESTION: do we want to keep this interpolation for rk4, or move to linear?
+  # Recompute the stages on the backward pass instead of storing them for every step
+  # (it is only ever called inside lax.scan, where the default CSE barriers aren't needed and just slow the step down)
+  @partial(jax.checkpoint, prevent_cse=False)
   @jit
   def rk4_step(x, u1, u2, u3, t):
     k1 = dynamics_t(x, u1, t)
@@ -87,6 +91,9 @@ def integrate_time_independent(
 ) -> Tuple[State, States]:
   # QUESTION: do we want to keep the mid-controls as decision variables for RK4,
   # or move to simply taking the average between the edge ones?
+  # Recompute the stages on the backward pass instead of storing them for every step
+  # (it is only ever called inside lax.scan, where the default CSE barriers aren't needed and just slow the step down)
+  @partial(jax.checkpoint, prevent_cse=False)
   @jit
   def rk4_step(x, u1, u2, u3):
     k1 = dynamics_t(x, u1)
@@ -131,6 +138,8 @@ def integrate_time_independent(
   return x_T, jnp.concatenate((x_0[jnp.newaxis], all_next_states))
 
 
+# Batching moves the vmap inside the scan: this is a single scan whose body steps every
+# interval at once, on (intervals, state) arrays, so there's no need for a hand-batched version
 integrate_time_independent_in_parallel = vmap(integrate_time_independent, in_axes=(None, 0, 0, None, None, None))
 
 
@@ -197,6 +206,28 @@ def integrate_fbsm(
     return x_T, jnp.concatenate((jnp.flipud(ys), x_0[None]))
 
 
+def ravel_states_and_controls(xs: States, us: Controls) -> Tuple[jnp.ndarray,
+                                                                  Callable[[jnp.ndarray], Tuple[States, Controls]]]:
+  """
+  Flatten states and controls into a single decision variable array, like `ravel_pytree((xs, us))` does.
+  The returned unravel function is just a slice and a reshape with precomputed sizes, which keeps the
+  traced graph (and so the compile time of everything that calls it) smaller than `ravel_pytree`'s version.
+  Args:
+    xs: States
+    us: Controls
+  Returns:
+    (the raveled states and controls, a function to split such an array back into states and controls)
+  """
+  xs_shape, us_shape = xs.shape, us.shape
+  num_state_vars = xs.size
+
+  def unravel(variables: jnp.ndarray) -> Tuple[States, Controls]:
+    variables = jnp.asarray(variables)  # like ravel_pytree, give jax arrays even for the solver's NumPy output
+    return variables[:num_state_vars].reshape(xs_shape), variables[num_state_vars:].reshape(us_shape)
+
+  return jnp.concatenate((jnp.ravel(xs), jnp.ravel(us))), unravel
+
+
 # First, get the optimal controls and resulting trajectory using the true system model.
 # Then, replace the model dynamics with the trained neural network,
 # and use that to find the "optimal" controls according to the NODE model.
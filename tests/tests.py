@@ -1,16 +1,27 @@
 # (c) Nikolaus Howe 2021
 from scipy.integrate import odeint
+from scipy.optimize import root
+from scipy.sparse import coo_matrix
 
+import jax
 import jax.numpy as jnp
 import numpy as np
 import sys
 import unittest
 
+from jax.flatten_util import ravel_pytree
 from run import run_trajectory_opt
-from myriad.config import IntegrationMethod, NLPSolverType, OptimizerType, QuadratureRule, SystemType
+from myriad.config import Config, HParams, IntegrationMethod, NLPSolverType, OptimizerType, QuadratureRule, SystemType
 from myriad.custom_types import State, Control, Timestep, States
+from myriad.nlp_solvers import cache_last_call, in_float32, value_and_jacfwd, value_and_jacrev
+from myriad.trajectory_optimizers import get_optimizer
 from myriad.useful_scripts import run_setup
-from myriad.utils import integrate
+from myriad.utils import integrate, ravel_states_and_controls
+
+try:
+  import cyipopt
+except ImportError:
+  cyipopt = None
 
 hp, cfg = run_setup(sys.argv, gin_path='../source/gin-configs/default.gin')
 
@@ -42,6 +53,60 @@ class BasicTests(unittest.TestCase):
                                            f'but it should have given {found_states[-1]}',
                                    verbose=True)
 
+  def test_ravel_states_and_controls(self):
+    xs = np.random.randn(7, 3)
+    us = np.random.randn(7, 2)
+    found, unravel = ravel_states_and_controls(xs, us)
+    expected, expected_unravel = ravel_pytree((xs, us))
+    np.testing.assert_array_equal(found, expected)
+
+    # Unravelling (for example, the solver's NumPy result) gives the same jax arrays as ravel_pytree's version
+    variables = np.random.randn(len(expected))
+    for found_part, expected_part in zip(unravel(variables), expected_unravel(variables)):
+      self.assertIsInstance(found_part, jax.Array)
+      np.testing.assert_array_equal(found_part, expected_part)
+
+  def test_value_and_jac(self):
+    def f(x: jnp.ndarray) -> jnp.ndarray:
+      return jnp.array([jnp.sin(x[0]) * x[1], jnp.exp(x[1] - x[2])])
+
+    x = jnp.array([0.3, -1.2, 0.7])
+    for value_and_jac, jac in ((value_and_jacrev, jax.jacrev), (value_and_jacfwd, jax.jacfwd)):
+      y, found_jac = value_and_jac(f)(x)
+      np.testing.assert_allclose(y, f(x), rtol=1e-6)
+      np.testing.assert_allclose(found_jac, jac(f)(x), rtol=1e-6)
+
+  def test_cache_last_call(self):
+    calls = []
+
+    def f(x: np.ndarray) -> float:
+      calls.append(x.copy())
+      return x.sum()
+
+    cached_f = cache_last_call(f)
+    x = np.array([1., 2.])
+    self.assertEqual(cached_f(x), 3.)
+    self.assertEqual(cached_f(x.copy()), 3.)  # a different array with the same bytes reuses the stored value
+    self.assertEqual(len(calls), 1)
+
+    x[0] = 5.  # the same array, changed in place (as the solvers do), is recomputed
+    self.assertEqual(cached_f(x), 7.)
+    self.assertEqual(len(calls), 2)
+
+  def test_in_float32(self):
+    jax.config.update("jax_enable_x64", True)
+    dtypes = []
+
+    def f(x: jnp.ndarray) -> jnp.ndarray:
+      dtypes.append(x.dtype)
+      return jnp.sin(x)
+
+    x = jnp.linspace(0., 1., 5, dtype=jnp.float64)
+    y = in_float32(f)(x)
+    self.assertEqual(dtypes, [jnp.float32])  # computed in single precision...
+    self.assertEqual(y.dtype, jnp.float64)  # ...but handed back in the input's precision
+    np.testing.assert_allclose(y, jnp.sin(x), rtol=1e-6)
+
 
 class OptimizerTests(unittest.TestCase):
   def test_single_shooting(self):
@@ -116,6 +181,150 @@ class OptimizerTests(unittest.TestCase):
 
     run_trajectory_opt(hp, cfg)
 
+  @unittest.skipIf(cyipopt is None, "cyipopt is not installed")
+  def test_ipopt_hermite_simpson_collocation(self):
+    global hp, cfg
+
+    hp.seed = 42
+    hp.system = SystemType.CARTPOLE
+    hp.optimizer = OptimizerType.COLLOCATION
+    hp.nlpsolver = NLPSolverType.IPOPT
+    hp.integration_method = IntegrationMethod.RK4
+    hp.quadrature_rule = QuadratureRule.HERMITE_SIMPSON
+    hp.max_iter = 1000
+    hp.intervals = 20
+    hp.controls_per_interval = 1
+
+    run_trajectory_opt(hp, cfg)
+
+  @unittest.skipIf(cyipopt is None, "cyipopt is not installed")
+  def test_ipopt_multiple_shooting(self):
+    global hp, cfg
+
+    hp.seed = 42
+    hp.system = SystemType.VANDERPOL
+    hp.optimizer = OptimizerType.SHOOTING
+    hp.nlpsolver = NLPSolverType.IPOPT
+    hp.integration_method = IntegrationMethod.RK4
+    hp.max_iter = 1000
+    hp.intervals = 20
+    hp.controls_per_interval = 1
+
+    run_trajectory_opt(hp, cfg)
+
+
+class ConstraintJacobianTests(unittest.TestCase):
+  def setUp(self):
+    jax.config.update("jax_enable_x64", True)
+
+  def test_hermite_simpson_sparse_jacobian(self):
+    for system in (SystemType.CARTPOLE, SystemType.HIVTREATMENT, SystemType.BEARPOPULATIONS):
+      with self.subTest(system=system):
+        jac_hp = HParams(system=system, optimizer=OptimizerType.COLLOCATION,
+                         quadrature_rule=QuadratureRule.HERMITE_SIMPSON, intervals=7)
+        optimizer = get_optimizer(jac_hp, Config(verbose=False), jac_hp.system())
+
+        # Evaluate away from the initial guess (positive, since some Lenhart dynamics take logs/roots)
+        np.random.seed(42)
+        variables = optimizer.guess + 0.1 * np.abs(np.random.randn(len(optimizer.guess)))
+
+        # The block-sparse Jacobian should have no repeated entries, and agree with the dense one
+        rows, cols, shape = optimizer.constraints_jac_structure
+        self.assertEqual(len(set(zip(rows, cols))), len(rows))
+        values = np.asarray(optimizer.constraints_jac_values(variables))
+        sparse_jac = coo_matrix((values, (rows, cols)), shape=shape).toarray()
+        dense_jac = np.asarray(jax.jacrev(optimizer.constraints)(variables))
+        np.testing.assert_allclose(sparse_jac, dense_jac, rtol=1e-10, atol=1e-12)
+
+
+class BoundsTests(unittest.TestCase):
+  def setUp(self):
+    jax.config.update("jax_enable_x64", True)
+
+  def test_control_bounds(self):
+    # Rocket landing has two controls with different bounds, so mixing them up is caught
+    approaches = {
+      'shooting': {'optimizer': OptimizerType.SHOOTING, 'intervals': 10, 'controls_per_interval': 2},
+      'trapezoidal': {'optimizer': OptimizerType.COLLOCATION, 'quadrature_rule': QuadratureRule.TRAPEZOIDAL},
+      'hermite_simpson': {'optimizer': OptimizerType.COLLOCATION, 'quadrature_rule': QuadratureRule.HERMITE_SIMPSON}
+    }
+    for approach in approaches:
+      with self.subTest(approach=approach):
+        bounds_hp = HParams(system=SystemType.ROCKETLANDING, **approaches[approach])
+        system = bounds_hp.system()
+        optimizer = get_optimizer(bounds_hp, Config(verbose=False), system)
+
+        # Find where each control ended up in the raveled decision variables
+        _, u_indices = optimizer.unravel(np.arange(len(optimizer.guess), dtype=np.float64))
+        u_indices = np.asarray(u_indices).astype(int)
+        control_bounds = system.bounds[-u_indices.shape[1]:]
+        for j in range(u_indices.shape[1]):
+          np.testing.assert_array_equal(optimizer.bounds[u_indices[:, j]],
+                                        np.broadcast_to(control_bounds[j], (u_indices.shape[0], 2)))
+
+
+class ObjectiveAndConstraintsTests(unittest.TestCase):
+  # The solvers take the objective and the constraints from objective_and_constraints, but their derivatives
+  # (and extragradient everything) from objective and constraints, so the two have to agree
+  def setUp(self):
+    jax.config.update("jax_enable_x64", True)
+
+  def check_objective_and_constraints(self, optimizer) -> None:
+    np.random.seed(42)
+    variables = optimizer.guess + 0.1 * np.abs(np.random.randn(len(optimizer.guess)))
+    cost, constraints = optimizer.objective_and_constraints(variables)
+    np.testing.assert_allclose(cost, optimizer.objective(variables), rtol=1e-12)
+    np.testing.assert_allclose(constraints, optimizer.constraints(variables), rtol=1e-10, atol=1e-12)
+
+  def test_shooting(self):
+    for integration_method in (IntegrationMethod.RK4, IntegrationMethod.HEUN, IntegrationMethod.EULER):
+      for intervals, controls_per_interval in ((10, 2), (1, 20)):  # multiple and single shooting
+        for system in (SystemType.VANDERPOL, SystemType.CARTPOLE):
+          with self.subTest(system=system, integration_method=integration_method, intervals=intervals):
+            shooting_hp = HParams(system=system, optimizer=OptimizerType.SHOOTING,
+                                  integration_method=integration_method, intervals=intervals,
+                                  controls_per_interval=controls_per_interval)
+            self.check_objective_and_constraints(get_optimizer(shooting_hp, Config(verbose=False),
+                                                               shooting_hp.system()))
+
+  def test_hermite_simpson(self):
+    for system in (SystemType.CARTPOLE, SystemType.VANDERPOL, SystemType.HIVTREATMENT, SystemType.BEARPOPULATIONS):
+      with self.subTest(system=system):
+        hs_hp = HParams(system=system, optimizer=OptimizerType.COLLOCATION,
+                        quadrature_rule=QuadratureRule.HERMITE_SIMPSON, intervals=7)
+        self.check_objective_and_constraints(get_optimizer(hs_hp, Config(verbose=False), hs_hp.system()))
+
+
+class InterpolationTests(unittest.TestCase):
+  def setUp(self):
+    jax.config.update("jax_enable_x64", True)
+
+  def test_hermite_simpson_interpolation(self):
+    interp_hp = HParams(system=SystemType.CARTPOLE, optimizer=OptimizerType.COLLOCATION,
+                        quadrature_rule=QuadratureRule.HERMITE_SIMPSON, intervals=10)
+    system = interp_hp.system()
+    optimizer = get_optimizer(interp_hp, Config(verbose=False), system)
+
+    # Make a feasible trajectory: fix the initial state and the controls,
+    # and solve the collocation constraints for the remaining states
+    ts = np.linspace(0, system.T, 2 * interp_hp.intervals + 1)
+    us = np.sin(ts)[:, None]
+
+    def constraints(other_xs: jnp.ndarray) -> jnp.ndarray:
+      return optimizer.constraints(jnp.concatenate((system.x_0, other_xs, us.ravel())))
+
+    solution = root(constraints, np.tile(system.x_0, 2 * interp_hp.intervals), jac=jax.jacrev(constraints))
+    self.assertTrue(solution.success)
+    xs = np.concatenate((system.x_0, solution.x)).reshape(len(ts), -1)
+
+    # The interpolants pass through the knot points and midpoints
+    np.testing.assert_allclose(optimizer.interpolate_states(ts, xs, us), xs, atol=1e-8)
+    np.testing.assert_allclose(optimizer.interpolate_controls(ts, us), us, atol=1e-8)
+
+    # At the end of each interval, the state interpolant reaches the next knot point
+    ends = ts[2::2] - 1e-12
+    np.testing.assert_allclose(optimizer.interpolate_states(ends, xs, us), xs[2::2], atol=1e-8)
+
 
 class IntegrationMethodTests(unittest.TestCase):
   def test_euler(self):